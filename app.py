@@ -23,17 +23,32 @@ SOFTWARE.
 """
 
 import argparse
+import bisect
+import csv
 import datetime
 import os
 import sys
-from typing import Iterable
-import toml
-from power_cost import PriceArea, fetch_electricity_cost_utc
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import compress
+from typing import Iterable, Optional
+import numpy as np
+
+try:
+    import tomllib  # Python 3.11+
+except ModuleNotFoundError:
+    import tomli as tomllib
+from power_cost import ElectricityCostUtc, PriceArea, fetch_electricity_cost_utc, parse_iso
 from zaptech_api import get_charging_sessions, get_zaptech_token
-from dateutil import parser  # To parse datetime strings
 from dataclasses import dataclass
 
-@dataclass
+ONE_HOUR = datetime.timedelta(hours=1)
+
+# Weekdays and hours where the day time net usage fee applies (Monday to Friday, 06:00 - 22:00)
+DAYTIME_TARIFF = np.zeros((7, 24), dtype=bool)
+DAYTIME_TARIFF[:5, 6:22] = True
+
+@dataclass(slots=True)
 class ChargingSessionEnergy:
     SessionId: str
     Timestamp: datetime.datetime
@@ -46,6 +61,69 @@ class ChargingSessionEnergy:
     TotalCostWithVAT: float  # New field for total cost with VAT
     CostCurrency: str
 
+@dataclass(slots=True)
+class DailyCosts:
+    """
+    Electricity costs for a single UTC day, indexed for fast lookup by timestamp.
+    """
+    windows: list  # Cost of each time window, sorted by start
+    starts: list  # Start time of each window, for bisection
+    hourly: list  # Window starting at each UTC hour, or None if the hour is not covered by a single window
+
+    @classmethod
+    def from_costs(cls, costs: Iterable[ElectricityCostUtc]) -> "DailyCosts":
+        windows = sorted(costs)
+
+        # Prices are usually hourly, in which case the hour alone identifies the window
+        hourly = [None] * 24
+        for window in windows:
+            start, end, _ = window
+            if end - start == ONE_HOUR and start.minute == 0 and start.second == 0 and start.microsecond == 0:
+                hourly[start.hour] = window
+
+        return cls(windows=windows, starts=[window.time_start for window in windows], hourly=hourly)
+
+    def find(self, timestamp: datetime.datetime) -> Optional[ElectricityCostUtc]:
+        """
+        Find the cost that is applicable for the given UTC timestamp.
+        """
+        window = self.hourly[timestamp.hour]
+        if window is not None:
+            return window
+
+        # Fall back to a binary search over the windows (e.g. for sub-hourly prices)
+        index = bisect.bisect_right(self.starts, timestamp) - 1
+        if index >= 0:
+            window = self.windows[index]
+            if timestamp < window.time_end:
+                return window
+        return None
+
+@lru_cache(maxsize=None)
+def get_daily_costs(energy_date: datetime.date, price_area: PriceArea) -> DailyCosts:
+    """
+    Get the indexed electricity costs of a UTC day, reusing them if the same day has been requested before.
+    """
+    return DailyCosts.from_costs(fetch_electricity_cost_utc(energy_date, area=price_area))
+
+@lru_cache(maxsize=16)
+def get_net_usage_fee_table(low_net_usage_fee: float, high_net_usage_fee: float) -> np.ndarray:
+    """
+    Get the net usage fee of every weekday and hour, as a read-only 7x24 table.
+    """
+    table = np.where(DAYTIME_TARIFF, high_net_usage_fee, low_net_usage_fee)
+    table.setflags(write=False)
+    return table
+
+def to_utc(timestamp: datetime.datetime) -> datetime.datetime:
+    """
+    Convert a timestamp to UTC, reusing it as is if it is already in UTC.
+    """
+    # Timestamps ending in "Z" or "+00:00" are parsed with datetime.timezone.utc
+    if timestamp.tzinfo is datetime.timezone.utc:
+        return timestamp
+    return timestamp.astimezone(tz=datetime.timezone.utc)
+
 def get_charging_session_energy(secrets, from_date, to_date, 
                                 price_area=PriceArea.NO2, 
                                 low_net_usage_fee=0.2259, high_net_usage_fee=0.3059):
@@ -56,73 +134,93 @@ def get_charging_session_energy(secrets, from_date, to_date,
     token = get_zaptech_token(username, password)
 
     history = get_charging_sessions(token, from_date, to_date)
-    costs = {}
 
+    # Extract the energy details of all sessions into parallel lists
+    session_ids = []
+    original_timestamps = []
+    energies = []
     for session in history.Data:
         for energy in session.EnergyDetails:
-            original_datetime = parser.parse(energy.Timestamp)
-
-            # Convert to the current time zone - this is because fetch_electricity_cost returns data in the local time zone
-            energy_datetime = original_datetime.astimezone(tz=datetime.timezone.utc)
-            energy_date = energy_datetime.date()
-
-            # See if cost is already cached
-            if energy_date not in costs:
-                # Fetch costs for this day and cache it
-                costs[energy_date] = fetch_electricity_cost_utc(energy_date, area=price_area)
-
-            # Find the cost that is applicable for the timestamp of the energy detail
-            applicable_cost = None
-            for cost in costs[energy_date]:
-                cost_start_time = parser.parse(cost.time_start)
-                cost_end_time = parser.parse(cost.time_end)
-
-                if cost_start_time <= energy_datetime < cost_end_time:
-                    applicable_cost = cost
-                    break
-            
-            if applicable_cost is None:
-                print(f"No applicable cost found for session {session.Id} at {energy.Timestamp}")
-                continue
-
-            # Calculate cost of the energy detail
-            energy_cost = energy.Energy * applicable_cost.NOK_per_kWh
-
-             # Calculate the net usage fee
-            daytime_start = energy_datetime.replace(hour=6, minute=0, second=0, microsecond=0)
-            daytime_end = energy_datetime.replace(hour=22, minute=0, second=0, microsecond=0)
-            
-            # Check if it's a weekend (Saturday or Sunday)
-            is_weekend = energy_datetime.weekday() >= 5
-            
-            # Use a lower rate during the night and on weekends
-            if daytime_start <= energy_datetime < daytime_end and not is_weekend:
-                net_usage_fee_per_kwh = high_net_usage_fee # day time net usage fee in NOK
-            else:
-                net_usage_fee_per_kwh = low_net_usage_fee # night time and weekend net usage fee in NOK
-            
-            net_usage_fee = energy.Energy * net_usage_fee_per_kwh
-
-            # Calculate total cost without VAT
-            total_cost_without_vat = energy_cost + net_usage_fee
-            
-            # Calculate total cost with VAT
-            total_cost_with_vat = total_cost_without_vat * 1.25  # adding 25% VAT
-
-            yield ChargingSessionEnergy(
-                SessionId=session.Id,
-                Timestamp=energy_datetime,
-                Energy=energy.Energy,
-                EnergyUsageFee=applicable_cost.NOK_per_kWh,
-                NetUsageFee=net_usage_fee, 
-                EnergyCost=energy_cost,
-                NetUsageCost=net_usage_fee,
-                TotalCostNoVat=total_cost_without_vat,  
-                TotalCostWithVAT=total_cost_with_vat,  
-                CostCurrency="NOK"
-            )
+            session_ids.append(session.Id)
+            original_timestamps.append(energy.Timestamp)
+            energies.append(energy.Energy)
+
+    # Convert to UTC - this is because fetch_electricity_cost_utc returns data in UTC
+    timestamps = [to_utc(parse_iso(timestamp)) for timestamp in original_timestamps]
+
+    # Group the energy details by UTC date
+    indices_by_date = {}
+    for index, timestamp in enumerate(timestamps):
+        indices_by_date.setdefault(timestamp.date(), []).append(index)
+
+    def find_daily_costs(energy_date, indices):
+        # Fetch the costs for this day and find the cost that is applicable for each of its energy details
+        daily_costs = get_daily_costs(energy_date, price_area)
+        return indices, [daily_costs.find(timestamps[index]) for index in indices]
+
+    # Process every day concurrently
+    applicable_costs = [None] * len(timestamps)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for indices, day_costs in executor.map(find_daily_costs, indices_by_date.keys(), indices_by_date.values()):
+            for index, cost in zip(indices, day_costs):
+                applicable_costs[index] = cost
+
+    # Skip energy details without an applicable cost
+    found = [cost is not None for cost in applicable_costs]
+
+    if not all(found):
+        for session_id, original_timestamp, is_found in zip(session_ids, original_timestamps, found):
+            if not is_found:
+                print(f"No applicable cost found for session {session_id} at {original_timestamp}")
+
+        session_ids = list(compress(session_ids, found))
+        timestamps = list(compress(timestamps, found))
+        energies = list(compress(energies, found))
+        applicable_costs = list(compress(applicable_costs, found))
+
+    energy_usage_fees = [cost.NOK_per_kWh for cost in applicable_costs]
+
+    # Calculate the costs of all energy details at once
+    energy_values = np.array(energies, dtype=np.float64)
+    energy_cost = energy_values * np.array(energy_usage_fees, dtype=np.float64)
+
+    # Calculate the net usage fee
+    epoch_seconds = np.array([int(timestamp.timestamp()) for timestamp in timestamps], dtype=np.int64)
+    hours = (epoch_seconds // 3600) % 24
+    weekdays = (epoch_seconds // 86400 + 3) % 7  # 1970-01-01 was a Thursday, Monday is 0
+
+    # Use a lower rate during the night and on weekends (Saturday or Sunday)
+    net_usage_fee_table = get_net_usage_fee_table(low_net_usage_fee, high_net_usage_fee)
+    net_usage_fee = net_usage_fee_table[weekdays, hours] * energy_values
+
+    # Calculate total cost without VAT
+    total_cost_without_vat = energy_cost + net_usage_fee
+
+    # Calculate total cost with VAT
+    total_cost_with_vat = total_cost_without_vat * 1.25  # adding 25% VAT
+
+    rows = zip(session_ids, timestamps, energies, energy_usage_fees, net_usage_fee.tolist(), energy_cost.tolist(),
+               total_cost_without_vat.tolist(), total_cost_with_vat.tolist())
+
+    for session_id, timestamp, energy, energy_usage_fee, net_fee, cost, total_no_vat, total_with_vat in rows:
+        yield ChargingSessionEnergy(
+            SessionId=session_id,
+            Timestamp=timestamp,
+            Energy=energy,
+            EnergyUsageFee=energy_usage_fee,
+            NetUsageFee=net_fee, 
+            EnergyCost=cost,
+            NetUsageCost=net_fee,
+            TotalCostNoVat=total_no_vat,  
+            TotalCostWithVAT=total_with_vat,  
+            CostCurrency="NOK"
+        )
 
 def get_secrets(args):
+    # Command line arguments take precedence, so there is no need to look further
+    if args.username and args.password:
+        return {"zaptech": {"username": args.username, "password": args.password}}
+
     # Check environment variables
     username = os.environ.get('ZAPTECH_USERNAME')
     password = os.environ.get('ZAPTECH_PASSWORD')
@@ -135,33 +233,33 @@ def get_secrets(args):
                 if args.secrets_file != "secrets.toml":
                     raise ValueError(f"Secrets file {args.secrets_file} does not exist. Create it or provide credentials via environment variables or command line arguments.")
             else:
-                secrets = toml.load(args.secrets_file)
+                with open(args.secrets_file, 'rb') as f:
+                    secrets = tomllib.load(f)
                 username = secrets["zaptech"]["username"]
                 password = secrets["zaptech"]["password"]
 
-    # Check command line arguments
-    if args.username and args.password:
-        username = args.username
-        password = args.password
-
     if username is None or password is None:
         raise ValueError("Credentials are missing. Provide them via environment variables, a secrets file, or command line arguments.")
 
     return {"zaptech": {"username": username, "password": password}}
 
+def parse_date(value: str) -> datetime.datetime:
+    # Parse a date argument in the format YYYY-MM-DD
+    return datetime.datetime.strptime(value, '%Y-%m-%d')
+
 def main():
-    parser = argparse.ArgumentParser(description='Fetch and calculate charging session energy costs.')
-    parser.add_argument('--from_date', required=True, type=lambda s: datetime.datetime.strptime(s, '%Y-%m-%d'), help='Start date (inclusive) in format YYYY-MM-DD.')
-    parser.add_argument('--to_date', required=True, type=lambda s: datetime.datetime.strptime(s, '%Y-%m-%d'), help='End date (exclusive) in format YYYY-MM-DD.')
-    parser.add_argument('--output_file', required=False, help='Path to the output CSV file.')
-    parser.add_argument('--secrets_file', default='secrets.toml', help='Path to the secrets file. Default is "secrets.toml".')
-    parser.add_argument('--username', help='Zaptech API username. Overrides secrets file.')
-    parser.add_argument('--password', help='Zaptech API password. Overrides secrets file.')
-    parser.add_argument('--price_area', default='NO2', help='Price area to use for electricity cost. Default is "NO2".')
-    parser.add_argument('--low_net_usage_fee', default=0.2259, type=float, help='Net usage fee for night time and weekends. Default is 0.2259 NOK/kWh.')
-    parser.add_argument('--high_net_usage_fee', default=0.3059, type=float, help='Net usage fee for day time. Default is 0.3059 NOK/kWh.')
-
-    args = parser.parse_args()
+    arg_parser = argparse.ArgumentParser(description='Fetch and calculate charging session energy costs.')
+    arg_parser.add_argument('--from_date', required=True, type=parse_date, help='Start date (inclusive) in format YYYY-MM-DD.')
+    arg_parser.add_argument('--to_date', required=True, type=parse_date, help='End date (exclusive) in format YYYY-MM-DD.')
+    arg_parser.add_argument('--output_file', required=False, help='Path to the output CSV file.')
+    arg_parser.add_argument('--secrets_file', default='secrets.toml', help='Path to the secrets file. Default is "secrets.toml".')
+    arg_parser.add_argument('--username', help='Zaptech API username. Overrides secrets file.')
+    arg_parser.add_argument('--password', help='Zaptech API password. Overrides secrets file.')
+    arg_parser.add_argument('--price_area', default='NO2', help='Price area to use for electricity cost. Default is "NO2".')
+    arg_parser.add_argument('--low_net_usage_fee', default=0.2259, type=float, help='Net usage fee for night time and weekends. Default is 0.2259 NOK/kWh.')
+    arg_parser.add_argument('--high_net_usage_fee', default=0.3059, type=float, help='Net usage fee for day time. Default is 0.3059 NOK/kWh.')
+
+    args = arg_parser.parse_args()
     secrets = get_secrets(args)
 
     # Parse price area
@@ -180,11 +278,16 @@ def main():
         print_csv(sessions, sys.stdout)
 
 def print_csv(sessions: Iterable[ChargingSessionEnergy], file):
-    # Print to CSV
-    print("SessionId,Timestamp,Energy,EnergyUsageFee,NetUsageFee,EnergyCost,NetUsageCost,TotalCostNoVat,TotalCostWithVAT,CostCurrency", file=file)
+    # Print to CSV (keep the line endings of the file, so output matches on every platform)
+    writer = csv.writer(file, lineterminator="\n")
+    writer.writerow(["SessionId", "Timestamp", "Energy", "EnergyUsageFee", "NetUsageFee", "EnergyCost", "NetUsageCost", 
+                     "TotalCostNoVat", "TotalCostWithVAT", "CostCurrency"])
 
-    for session in sessions:
-        print(f"{session.SessionId},{session.Timestamp},{session.Energy},{session.EnergyUsageFee},{session.NetUsageFee},{session.EnergyCost},{session.NetUsageCost},{session.TotalCostNoVat},{session.TotalCostWithVAT},{session.CostCurrency}", file=file)
+    writer.writerows(
+        (session.SessionId, session.Timestamp, session.Energy, session.EnergyUsageFee, session.NetUsageFee, session.EnergyCost, 
+         session.NetUsageCost, session.TotalCostNoVat, session.TotalCostWithVAT, session.CostCurrency)
+        for session in sessions
+    )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,14 +1,20 @@
 from dataclasses import dataclass
 from enum import Enum
-from typing import List
+from typing import List, NamedTuple
 
-import pytz
 import os
 import json
+import tempfile
 import requests
-from datetime import datetime, timedelta
-from dateutil import parser  # to parse datetime strings
-from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+# Time zones used by the electricity cost data
+OSLO_TZ = ZoneInfo("Europe/Oslo")
+UTC = timezone.utc
+
+# HTTP session shared by all requests, so that connections are reused
+http_session = requests.Session()
 
 # Enum for price areas
 class PriceArea(Enum):
@@ -19,7 +25,7 @@ class PriceArea(Enum):
     NO5 = "Bergen / Vest-Norge"
 
 # Data class for electricity cost information
-@dataclass
+@dataclass(slots=True)
 class ElectricityCost:
     NOK_per_kWh: float
     EUR_per_kWh: float
@@ -30,6 +36,44 @@ class ElectricityCost:
 # Type hint for a list of electricity costs
 ElectricityCostList = List[ElectricityCost]
 
+# Electricity cost of a time window in UTC (a plain tuple, as a day can have many windows)
+class ElectricityCostUtc(NamedTuple):
+    time_start: datetime
+    time_end: datetime
+    NOK_per_kWh: float
+
+# Type hint for a list of UTC electricity costs
+ElectricityCostUtcList = List[ElectricityCostUtc]
+
+def parse_iso(value: str) -> datetime:
+    """
+    Parse an ISO-8601 timestamp, such as those returned by the ZapTech and hvakosterstrommen.no APIs.
+
+    Parameters:
+        value (str): The timestamp to parse. A trailing "Z" is accepted as UTC.
+
+    Returns:
+        datetime: The parsed datetime.
+    """
+    # datetime.fromisoformat only accepts a "Z" suffix from Python 3.11 onwards
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+def write_json_cache(path: str, data) -> None:
+    """
+    Write data to a JSON cache file, replacing it atomically so concurrent readers never see a partial file.
+
+    Parameters:
+        path (str): The path of the cache file.
+        data: The JSON serializable data to write.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
 def fetch_electricity_cost(date: datetime, area: PriceArea) -> ElectricityCostList:
     # Format year, month, and day
     year = date.strftime("%Y")
@@ -49,23 +93,21 @@ def fetch_electricity_cost(date: datetime, area: PriceArea) -> ElectricityCostLi
     url = f"https://www.hvakosterstrommen.no/api/v1/prices/{year}/{month}-{day}_{area.name}.json"
     
     # Fetch the data from API (NOTE: This will not run in this environment)
-    response = requests.get(url)
+    response = http_session.get(url)
     
     # Check if request was successful
     if response.status_code == 200:
         data = response.json()
         
         # Cache the data
-        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-        with open(cache_path, 'w') as f:
-            json.dump(data, f)
+        write_json_cache(cache_path, data)
             
         # Return data as a list of ElectricityCost objects
         return [ElectricityCost(**item) for item in data]
     else:
         raise Exception(f"Failed to fetch data: {response.status_code}")
 
-def fetch_electricity_cost_utc(date_utc: datetime, area: PriceArea) -> list:
+def fetch_electricity_cost_utc(date_utc: datetime, area: PriceArea) -> ElectricityCostUtcList:
     """
     Fetch electricity cost data adjusted to UTC.
 
@@ -74,18 +116,34 @@ def fetch_electricity_cost_utc(date_utc: datetime, area: PriceArea) -> list:
         area (PriceArea): The price area to fetch electricity cost data for.
 
     Returns:
-        list: A list of electricity cost data for the entire UTC day.
+        ElectricityCostUtcList: A list of electricity cost data for the entire UTC day.
     """
-    # Time zone information
-    oslo_tz = pytz.timezone("Europe/Oslo")
+    # Create path for caching the UTC adjusted data
+    year = date_utc.strftime("%Y")
+    month = date_utc.strftime("%m")
+    day = date_utc.strftime("%d")
+    cache_path = os.path.join("cache", "utc", year, month, f"{day}_{area.name}.json")
+
+    # Check if data is already cached (time windows are stored as epoch seconds)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r') as f:
+            cached_data = json.load(f)
+            return [
+                ElectricityCostUtc(
+                    datetime.fromtimestamp(item["time_start"], tz=UTC),
+                    datetime.fromtimestamp(item["time_end"], tz=UTC),
+                    item["NOK_per_kWh"]
+                )
+                for item in cached_data
+            ]
 
     # Define the start and end of the UTC day
-    start_date_utc = datetime(date_utc.year, date_utc.month, date_utc.day, tzinfo=pytz.utc)
+    start_date_utc = datetime(date_utc.year, date_utc.month, date_utc.day, tzinfo=UTC)
     end_date_utc = start_date_utc + timedelta(days=1) - timedelta(seconds=1)
 
     # Convert the UTC dates to Oslo time
-    start_date_oslo = start_date_utc.astimezone(oslo_tz).date()
-    end_date_oslo = end_date_utc.astimezone(oslo_tz).date()
+    start_date_oslo = start_date_utc.astimezone(OSLO_TZ).date()
+    end_date_oslo = end_date_utc.astimezone(OSLO_TZ).date()
 
     # Fetch the electricity cost data for the Oslo dates
     if start_date_oslo == end_date_oslo:
@@ -96,13 +154,22 @@ def fetch_electricity_cost_utc(date_utc: datetime, area: PriceArea) -> list:
     # Filter the costs based on the original UTC time range and adjust times to UTC
     costs_utc = []
     for cost in costs_oslo:
-        time_start_utc = parser.parse(cost.time_start).astimezone(pytz.utc)
-        time_end_utc = parser.parse(cost.time_end).astimezone(pytz.utc)
+        time_start_utc = parse_iso(cost.time_start).astimezone(UTC)
+        time_end_utc = parse_iso(cost.time_end).astimezone(UTC)
 
         # Check if the cost is within the original UTC time range
         if time_end_utc > start_date_utc and time_start_utc <= end_date_utc:
-            cost_utc = replace(cost, time_start=time_start_utc.isoformat(), time_end=time_end_utc.isoformat())
-            costs_utc.append(cost_utc)
+            costs_utc.append(ElectricityCostUtc(time_start_utc, time_end_utc, cost.NOK_per_kWh))
+
+    # Cache the data
+    write_json_cache(cache_path, [
+        {
+            "NOK_per_kWh": cost.NOK_per_kWh,
+            "time_start": int(cost.time_start.timestamp()),
+            "time_end": int(cost.time_end.timestamp())
+        }
+        for cost in costs_utc
+    ])
 
     return costs_utc
 
@@ -1,20 +1,25 @@
 import requests
-import toml
 
+try:
+    import tomllib  # Python 3.11+
+except ModuleNotFoundError:
+    import tomli as tomllib
+
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dataclasses import dataclass
 from typing import List, Optional
 
-from dataclasses_json import dataclass_json
-
-@dataclass_json
-@dataclass
+@dataclass(slots=True)
 class EnergyDetail:
     Timestamp: str
     Energy: float
 
-@dataclass_json
-@dataclass
+    @classmethod
+    def from_dict(cls, data: dict) -> "EnergyDetail":
+        return cls(Timestamp=data["Timestamp"], Energy=data["Energy"])
+
+@dataclass(slots=True)
 class ChargerFirmwareVersion:
     Major: int
     Minor: int
@@ -23,8 +28,18 @@ class ChargerFirmwareVersion:
     MajorRevision: int
     MinorRevision: int
 
-@dataclass_json
-@dataclass
+    @classmethod
+    def from_dict(cls, data: dict) -> "ChargerFirmwareVersion":
+        return cls(
+            Major=data["Major"],
+            Minor=data["Minor"],
+            Build=data["Build"],
+            Revision=data["Revision"],
+            MajorRevision=data["MajorRevision"],
+            MinorRevision=data["MinorRevision"]
+        )
+
+@dataclass(slots=True)
 class ChargingSession:
     Id: str
     DeviceId: str
@@ -37,15 +52,38 @@ class ChargingSession:
     DeviceName: str
     ExternallyEnded: bool
     EnergyDetails: List[EnergyDetail]
-    ChargerFirmwareVersion: ChargerFirmwareVersion
+    ChargerFirmwareVersion: Optional[ChargerFirmwareVersion]
     SignedSession: str
 
-@dataclass_json
-@dataclass
+    @classmethod
+    def from_dict(cls, data: dict) -> "ChargingSession":
+        firmware_version = data["ChargerFirmwareVersion"]
+
+        return cls(
+            Id=data["Id"],
+            DeviceId=data["DeviceId"],
+            StartDateTime=data["StartDateTime"],
+            EndDateTime=data["EndDateTime"],
+            Energy=data["Energy"],
+            CommitMetadata=data["CommitMetadata"],
+            CommitEndDateTime=data["CommitEndDateTime"],
+            ChargerId=data["ChargerId"],
+            DeviceName=data["DeviceName"],
+            ExternallyEnded=data["ExternallyEnded"],
+            EnergyDetails=[EnergyDetail.from_dict(detail) for detail in data["EnergyDetails"]],
+            ChargerFirmwareVersion=ChargerFirmwareVersion.from_dict(firmware_version) if firmware_version is not None else None,
+            SignedSession=data["SignedSession"]
+        )
+
+@dataclass(slots=True)
 class ChargingHistory:
     Pages: int
     Data: List[ChargingSession]
 
+    @classmethod
+    def from_dict(cls, data: dict) -> "ChargingHistory":
+        return cls(Pages=data["Pages"], Data=[ChargingSession.from_dict(session) for session in data["Data"]])
+
 
 def get_zaptech_token(username: str, password: str) -> str:
     """
@@ -82,12 +120,13 @@ def get_zaptech_token(username: str, password: str) -> str:
     else:
         raise Exception(f"Authentication failed: {response.status_code} - {response.text}")
 
-def get_charging_sessions(token: str, from_date: datetime, to_date: datetime, 
-                          page_index: int = 0, page_size: int = 500) -> ChargingHistory:
+def get_charging_sessions_page(session: requests.Session, token: str, from_date: datetime, to_date: datetime,
+                               page_index: int = 0, page_size: int = 500) -> ChargingHistory:
     """
-    Fetch charging sessions from the ZapTech API.
+    Fetch a single page of charging sessions from the ZapTech API.
 
     Parameters:
+        session (requests.Session): HTTP session to send the request with.
         token (str): Bearer token for API authentication.
         from_date (datetime): Start of the date range.
         to_date (datetime): End of the date range.
@@ -95,7 +134,7 @@ def get_charging_sessions(token: str, from_date: datetime, to_date: datetime,
         page_size (int, optional): Number of items per page. Defaults to 500.
 
     Returns:
-        ChargingHistory: Object containing charging session data.
+        ChargingHistory: Object containing charging session data for the page.
     """
     # API endpoint
     api_url = "https://api.zaptec.com/api/chargehistory"
@@ -116,7 +155,7 @@ def get_charging_sessions(token: str, from_date: datetime, to_date: datetime,
     }
     
     # Make GET request
-    response = requests.get(api_url, params=params, headers=headers)
+    response = session.get(api_url, params=params, headers=headers)
     
     # Check if request was successful
     if response.status_code == 200:
@@ -125,9 +164,43 @@ def get_charging_sessions(token: str, from_date: datetime, to_date: datetime,
     else:
         raise Exception(f"Failed to fetch data: {response.status_code} - {response.text}")
 
+def get_charging_sessions(token: str, from_date: datetime, to_date: datetime, 
+                          page_size: int = 500, max_workers: int = 8) -> ChargingHistory:
+    """
+    Fetch all charging sessions from the ZapTech API.
+
+    The first page is fetched to find the number of pages, after which the remaining pages are fetched concurrently.
+
+    Parameters:
+        token (str): Bearer token for API authentication.
+        from_date (datetime): Start of the date range.
+        to_date (datetime): End of the date range.
+        page_size (int, optional): Number of items per page. Defaults to 500.
+        max_workers (int, optional): Maximum number of pages to fetch at once. Defaults to 8.
+
+    Returns:
+        ChargingHistory: Object containing charging session data from all pages.
+    """
+    with requests.Session() as session:
+        result = get_charging_sessions_page(session, token, from_date, to_date, page_index=0, page_size=page_size)
+
+        if result.Pages > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                pages = executor.map(
+                    lambda page_index: get_charging_sessions_page(session, token, from_date, to_date, 
+                                                                  page_index=page_index, page_size=page_size),
+                    range(1, result.Pages)
+                )
+                # Merge the pages in order
+                for page in pages:
+                    result.Data.extend(page.Data)
+
+    return result
+
 if __name__ == "__main__":
     # Get secrets from toml file
-    secrets = toml.load("secrets.toml")
+    with open("secrets.toml", 'rb') as f:
+        secrets = tomllib.load(f)
     username = secrets["zaptech"]["username"]
     password = secrets["zaptech"]["password"]
 